@@ -1,103 +1,82 @@
 import os
+import atexit
 import logging
+import queue
 import asyncio
-import re
+from logging.handlers import QueueHandler, QueueListener
+import concurrent.futures
+import random
 import time
 from telegram import Update
 from telegram.ext import Application, CommandHandler, PollAnswerHandler, ContextTypes
-import google.generativeai as genai
+from telegram.request import HTTPXRequest
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+# Configure logging: handlers enqueue records and return immediately; the
+# QueueListener thread does the formatting and stream write, so logging in
+# async handlers never blocks the event loop on stderr I/O.
+_log_queue = queue.Queue(-1)
+_stream_handler = logging.StreamHandler()
+_stream_handler.setFormatter(
+    logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 )
+_root_logger = logging.getLogger()
+_root_logger.setLevel(logging.INFO)
+_root_logger.addHandler(QueueHandler(_log_queue))
+_log_listener = QueueListener(_log_queue, _stream_handler, respect_handler_level=True)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
 logger = logging.getLogger(__name__)
 
-# Read API keys and temperature from environment
-GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
+# Generation, parsing, and the question pool live in quiz_core so every
+# front-end shares one model instance and one cache.
+import quiz_core
+
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
-GEMINI_TEMPERATURE = 0.85  # Model creativity
 
-if not GOOGLE_API_KEY or not TELEGRAM_TOKEN:
-    raise ValueError("Please set GOOGLE_API_KEY and TELEGRAM_TOKEN in .env file")
+if not TELEGRAM_TOKEN:
+    raise ValueError("Please set TELEGRAM_TOKEN in .env file")
 
-genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel('gemini-2.0-flash')
+# Static handler replies, built once at import
+_WELCOME = (
+    "👋 Welcome to the Cucumber + Capybara Quiz Bot!\n\n"
+    "Use /quiz to get a new question about Cucumber and Capybara testing.\n"
+    "Each question will have three options, and you'll get an explanation for the correct answer."
+)
+_HELP = "Use /quiz to get a quiz question."
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    welcome_message = (
-        "\U0001F44B Welcome to the Cucumber + Capybara Quiz Bot!\n\n"
-        "Use /quiz to get a new question about Cucumber and Capybara testing.\n"
-        "Each question will have three options, and you'll get an explanation for the correct answer."
-    )
-    await update.message.reply_text(welcome_message)
-
-def generate_quiz_question_sync(max_retries=3):
-    prompt = """Generate a multiple-choice question about Cucumber and Capybara testing for freshers. \
-    The question should have four options and include a short explanation (one or two sentences) for the correct answer.\
-    Each option should be one word or a maximum of three words.\
-    Format the response as follows:\
-    Question: [question text]\
-    Options:\
-    A) [option 1]\
-    B) [option 2]\
-    C) [option 3]\
-    D) [option 4]\
-    Correct Answer: [letter]\
-    Explanation: [explanation]"""
-
-    for attempt in range(max_retries):
-        try:
-            response = model.generate_content(
-                contents=prompt,
-                generation_config={"temperature": GEMINI_TEMPERATURE}
-            )
-            return response.text
-        except Exception as e:
-            logger.error(f"Error in Gemini API (Attempt {attempt+1}): {e}")
-            if attempt < max_retries - 1:
-                sleep_time = 2 ** attempt
-                time.sleep(sleep_time)
-            else:
-                return None
-
-async def generate_quiz_question():
-    return await asyncio.to_thread(generate_quiz_question_sync)
-
-def parse_quiz_response(response_text):
-    try:
-        question_match = re.search(r'Question:\s*(.*)', response_text)
-        question = question_match.group(1).strip() if question_match else "Question not found"
-
-        options = re.findall(r'(A|B|C|D)\)\s*(.*)', response_text)
-        option_list = [text for letter, text in options]
-
-        correct_match = re.search(r'Correct Answer:\s*([A-D])', response_text)
-        correct_answer_letter = correct_match.group(1) if correct_match else None
-        correct_index = ord(correct_answer_letter) - ord('A') if correct_answer_letter else None
-
-        explanation_match = re.search(r'Explanation:\s*(.*)', response_text, re.DOTALL)
-        explanation = explanation_match.group(1).strip() if explanation_match else ''
-
-        return question, option_list, correct_index, explanation
-
-    except Exception as e:
-        logger.error(f"Error parsing quiz response: {e}")
-        return None, [], None, ''
+    await update.message.reply_text(_WELCOME)
+
+# Unanswered polls would otherwise accumulate in bot_data forever; cap the
+# store and lazily drop entries older than a day on each write.
+_POLL_DATA_MAX = 512
+_POLL_DATA_TTL = 24 * 60 * 60  # seconds
+
+def _store_poll_data(bot_data, poll_id, explanation, chat_id):
+    now = time.monotonic()
+    for key in [k for k, v in bot_data.items() if now - v["ts"] > _POLL_DATA_TTL]:
+        del bot_data[key]
+    bot_data[poll_id] = {
+        "explanation": explanation,
+        "chat_id": chat_id,
+        "ts": now
+    }
+    while len(bot_data) > _POLL_DATA_MAX:
+        del bot_data[next(iter(bot_data))]
 
 async def quiz(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    response_text = await generate_quiz_question()
+    parsed = await quiz_core.next_question()
 
-    if not response_text:
+    if parsed is None:
         await update.message.reply_text("Sorry, failed to generate quiz question. Please try again later.")
         return
 
-    question, options, correct_index, explanation = parse_quiz_response(response_text)
+    question, options, correct_index, explanation = parsed
 
     if correct_index is None or not options:
         await update.message.reply_text("Sorry, could not parse question correctly. Please try again.")
@@ -112,16 +91,14 @@ async def quiz(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
     # Save both explanation and chat_id mapped to poll id
-    context.bot_data[poll_message.poll.id] = {
-        "explanation": explanation,
-        "chat_id": update.effective_chat.id
-    }
+    _store_poll_data(context.bot_data, poll_message.poll.id, explanation, update.effective_chat.id)
 
 async def receive_poll_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     poll_id = update.poll_answer.poll_id
     user = update.effective_user
 
-    data = context.bot_data.get(poll_id)
+    # Pop so answered polls don't linger in bot_data
+    data = context.bot_data.pop(poll_id, None)
     if data:
         explanation = data["explanation"]
         chat_id = data["chat_id"]
@@ -132,42 +109,92 @@ async def receive_poll_answer(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("Use /quiz to get a quiz question.")
+    await update.message.reply_text(_HELP)
 
-async def send_quiz_periodically(application, chat_id, interval_seconds=600):
+async def send_quiz_periodically(application, chat_ids, interval_seconds=600):
+    """Single scheduler for all periodic chats: one generated question fans
+    out to every chat, and the jittered sleep keeps ticks from lining up
+    into synchronized API bursts."""
     while True:
         try:
-            # Create a dummy Update and Context for the quiz function
-            class DummyMessage:
-                async def reply_text(self, text):
-                    await application.bot.send_message(chat_id=chat_id, text=text)
-                async def reply_poll(self, **kwargs):
-                    return await application.bot.send_poll(chat_id=chat_id, **kwargs)
-            class DummyUpdate:
-                message = DummyMessage()
-                effective_chat = type('obj', (object,), {'id': chat_id})()
-            class DummyContext:
-                bot_data = application.bot_data
-            await quiz(DummyUpdate(), DummyContext())
+            parsed = await quiz_core.next_question()
+            if parsed is not None and parsed[2] is not None and parsed[1]:
+                question, options, correct_index, explanation = parsed
+                poll_messages = await asyncio.gather(
+                    *[application.bot.send_poll(
+                        chat_id=chat_id,
+                        question=question,
+                        options=options,
+                        type="quiz",
+                        correct_option_id=correct_index,
+                        is_anonymous=False
+                    ) for chat_id in chat_ids],
+                    return_exceptions=True
+                )
+                for chat_id, poll_message in zip(chat_ids, poll_messages):
+                    if isinstance(poll_message, Exception):
+                        logger.error(f"Error sending periodic quiz to {chat_id}: {poll_message}")
+                    else:
+                        _store_poll_data(application.bot_data, poll_message.poll.id, explanation, chat_id)
         except Exception as e:
             logger.error(f"Error sending periodic quiz: {e}")
-        await asyncio.sleep(interval_seconds)
+        await asyncio.sleep(interval_seconds + random.uniform(0, interval_seconds * 0.1))
 
 def main():
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    quiz_core.load_pool()
+
+    # Enlarge the default executor beyond asyncio's cpu_count()+4 cap so any
+    # remaining to_thread/run_in_executor work doesn't serialize under load.
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(
+        max_workers=int(os.getenv('THREAD_POOL_SIZE', os.cpu_count() * 5))
+    ))
+
+    # Set your group or user chat_ids here for periodic quizzes; one
+    # scheduler serves them all from the same generated question.
+    PERIODIC_CHAT_IDS = []   # e.g., [-1001234567890] or your user id(s)
+    INTERVAL_SECONDS = 600   # 10 minutes
+
+    async def _post_init(app):
+        # Runs on the application's event loop, so tasks can be created here
+        # (create_task in main() would raise: no loop is running yet).
+        if PERIODIC_CHAT_IDS:
+            app.create_task(send_quiz_periodically(app, PERIODIC_CHAT_IDS, INTERVAL_SECONDS))
+
+    # Persistent HTTP/2 connection pools: one for outgoing bot calls, a
+    # separate one for getUpdates so a stuck long-poll can't starve sends.
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .request(HTTPXRequest(http_version="2", connection_pool_size=64, pool_timeout=1.0))
+        .get_updates_request(HTTPXRequest(http_version="2", connection_pool_size=8))
+        .post_init(_post_init)
+        .build()
+    )
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("quiz", quiz))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(PollAnswerHandler(receive_poll_answer))
 
-    # Set your group or user chat_id here for periodic quiz
-    PERIODIC_CHAT_ID = None  # e.g., -1001234567890 or your user id
-    INTERVAL_SECONDS = 600   # 10 minutes
-    if PERIODIC_CHAT_ID:
-        application.create_task(send_quiz_periodically(application, PERIODIC_CHAT_ID, INTERVAL_SECONDS))
+    # Webhooks push each update once instead of long-polling getUpdates;
+    # set PUBLIC_URL (e.g. https://bot.example.com) to enable them. Without
+    # a public URL (local runs) fall back to polling.
+    public_url = os.getenv('PUBLIC_URL')
+    if public_url:
+        application.run_webhook(
+            listen='0.0.0.0',
+            port=int(os.getenv('PORT', 8443)),
+            url_path=TELEGRAM_TOKEN,
+            webhook_url=f"{public_url.rstrip('/')}/{TELEGRAM_TOKEN}",
+            allowed_updates=Update.ALL_TYPES
+        )
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # run_webhook/run_polling block until shutdown; keep the cache warm across restarts
+    quiz_core.save_pool()
 
 if __name__ == '__main__':
     main()
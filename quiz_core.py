@@ -0,0 +1,331 @@
+"""Shared quiz generation core: Gemini client, parsing, and the question pool.
+
+Front-ends (the poll bot, or any future renderer) import next_question()
+from here so the model instance, prompt cache, batcher, and question pool
+are all shared process-wide instead of being duplicated per bot variant.
+"""
+
+import os
+import datetime
+import functools
+import json
+import logging
+import asyncio
+import math
+import time
+from collections import Counter, deque
+
+import google.generativeai as genai
+from google.ai.generativelanguage import Content, Part
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
+GEMINI_TEMPERATURE = 0.85  # Model creativity
+
+if not GOOGLE_API_KEY:
+    raise ValueError("Please set GOOGLE_API_KEY in .env file")
+
+genai.configure(api_key=GOOGLE_API_KEY)
+
+GEMINI_MODEL_NAME = 'gemini-2.0-flash'
+
+# The long format instruction never changes, so push it into a server-side
+# cached content object; each request then only sends the short delta prompt.
+SYSTEM_INSTRUCTION = """You generate multiple-choice questions about Cucumber and Capybara testing for freshers. \
+    Each question should have four options and include a short explanation (one or two sentences) for the correct answer.\
+    Each option should be one word or a maximum of three words."""
+
+# Structured-output schema: the model returns a JSON array of question
+# objects, so parsing is a json.loads instead of scanning text. Field and
+# type spellings follow protos.Schema (uppercase Type enum, snake_case
+# min_items/max_items), which is what the SDK parses this dict into.
+_QUESTION_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "question": {"type": "STRING"},
+            "options": {"type": "ARRAY", "items": {"type": "STRING"}, "min_items": 4, "max_items": 4},
+            "correct_index": {"type": "INTEGER"},
+            "explanation": {"type": "STRING"}
+        },
+        "required": ["question", "options", "correct_index", "explanation"]
+    }
+}
+
+_PROMPT_CACHE_TTL = 3600  # seconds
+
+def _build_model():
+    try:
+        cache = genai.caching.CachedContent.create(
+            model=GEMINI_MODEL_NAME,
+            system_instruction=SYSTEM_INSTRUCTION,
+            ttl=datetime.timedelta(seconds=_PROMPT_CACHE_TTL)
+        )
+        return genai.GenerativeModel.from_cached_content(cache)
+    except Exception as e:
+        logger.warning(f"Gemini prompt cache unavailable ({e}); falling back to plain model")
+        return genai.GenerativeModel(GEMINI_MODEL_NAME, system_instruction=SYSTEM_INSTRUCTION)
+
+model = _build_model()
+_model_built_at = time.monotonic()
+
+async def _maybe_refresh_prompt_cache():
+    # Rebuild the cached content shortly before its TTL runs out so requests
+    # never land on an expired cache.
+    global model, _model_built_at
+    if time.monotonic() - _model_built_at < _PROMPT_CACHE_TTL - 300:
+        return
+    _model_built_at = time.monotonic()
+    model = await asyncio.to_thread(_build_model)
+
+# Pool of (word_vector, parsed_tuple) pairs so /quiz can usually skip the
+# Gemini round-trip and just pop a cached question. The word vector is used
+# to reject near-duplicate questions at refill time.
+_QUESTION_POOL = deque(maxlen=64)
+_POOL_LOW_WATER = 4
+_POOL_FILE = 'question_pool.json'
+_DEDUP_THRESHOLD = 0.6  # max cosine similarity to any pooled question
+_refill_running = False
+# Strong references to in-flight refill tasks; bare create_task results may
+# be garbage-collected mid-run per the asyncio docs.
+_refill_tasks = set()
+
+_STOPWORDS = frozenset(
+    'a an the is are was were be been of in on at for to and or not '
+    'what which who how why when where does do did can could should '
+    'would will you your it its this that with by as from'.split()
+)
+
+def _vec(text):
+    """Word co-occurrence vector: counts of crudely stemmed non-stopword tokens."""
+    counts = Counter()
+    for token in text.lower().split():
+        token = token.strip('.,?!:;()"\'`')
+        if not token or token in _STOPWORDS:
+            continue
+        for suffix in ('ing', 'ed', 'es', 's'):
+            if len(token) > len(suffix) + 2 and token.endswith(suffix):
+                token = token[:-len(suffix)]
+                break
+        counts[token] += 1
+    return counts
+
+def _sim(a, b):
+    dot = sum(a[k] * b[k] for k in a.keys() & b.keys())
+    if not dot:
+        return 0.0
+    norm = math.sqrt(sum(v * v for v in a.values()) * sum(v * v for v in b.values()))
+    return dot / norm
+
+# Short delta prompt; the full format spec lives in the cached system instruction.
+PROMPT_TEMPLATE = "Generate {count} question(s) now, on different topics than last time."
+
+@functools.lru_cache(maxsize=8)
+def _prompt_content(count):
+    # Materialize the protobuf Content once per batch size so repeated calls
+    # skip the per-request str -> Part -> Content marshaling.
+    return Content(role='user', parts=[Part(text=PROMPT_TEMPLATE.format(count=count))])
+
+async def _call_gemini_once(contents):
+    # Single attempt, no retry policy: raises so the caller decides backoff.
+    response = await model.generate_content_async(
+        contents=contents,
+        generation_config={
+            "temperature": GEMINI_TEMPERATURE,
+            "response_mime_type": "application/json",
+            "response_schema": _QUESTION_SCHEMA
+        }
+    )
+    return response.text
+
+async def generate_content(contents, max_retries=3):
+    # Backoff happens at the async layer, so waiting between attempts costs
+    # no threads and the event loop keeps scheduling other handlers.
+    for attempt in range(max_retries):
+        try:
+            return await _call_gemini_once(contents)
+        except Exception as e:
+            logger.error(f"Error in Gemini API (Attempt {attempt+1}): {e}")
+            if attempt < max_retries - 1:
+                await asyncio.sleep(2 ** attempt)
+    return None
+
+# Batch concurrent generation requests into a single Gemini call: waiters
+# queue a Future, the batcher drains up to MAX_BATCH of them (or whatever
+# arrived within MAX_WAIT), asks for that many questions at once, and
+# hands one parsed question back per waiter.
+MAX_BATCH = 8
+MAX_WAIT = 0.05  # seconds to wait for more requests to coalesce
+
+_GEN_QUEUE: asyncio.Queue = asyncio.Queue()
+_batcher_task = None
+
+async def _batcher():
+    loop = asyncio.get_running_loop()
+    while True:
+        waiters = [await _GEN_QUEUE.get()]
+        deadline = loop.time() + MAX_WAIT
+        while len(waiters) < MAX_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                waiters.append(await asyncio.wait_for(_GEN_QUEUE.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        try:
+            await _maybe_refresh_prompt_cache()
+            response_text = await generate_content([_prompt_content(len(waiters))])
+            questions = _parse_questions(response_text)
+        except Exception as e:
+            logger.error(f"Error in generation batch: {e}")
+            questions = []
+
+        for i, future in enumerate(waiters):
+            if not future.done():
+                future.set_result(questions[i] if i < len(questions) else None)
+
+async def generate_quiz_question():
+    """Request one parsed question tuple via the batched generator."""
+    global _batcher_task
+    if _batcher_task is None or _batcher_task.done():
+        _batcher_task = asyncio.create_task(_batcher())
+    future = asyncio.get_running_loop().create_future()
+    await _GEN_QUEUE.put(future)
+    return await future
+
+def parse_quiz_response(response_text):
+    # Single pass over the response: every field lives on its own header line,
+    # so one splitlines() walk replaces the old four regex scans.
+    try:
+        question = "Question not found"
+        option_list = []
+        correct_index = None
+        explanation_lines = []
+        in_explanation = False
+
+        for line in response_text.splitlines():
+            line = line.strip()
+            if in_explanation:
+                explanation_lines.append(line)
+                continue
+            if len(line) >= 2 and line[1] == ')' and line[0] in 'ABCD':
+                option_list.append(line[2:].lstrip())
+                continue
+            # Header lines are all literal "Key: value" pairs; partition is
+            # cheaper than prefix-testing each key in turn.
+            key, sep, value = line.partition(':')
+            if not sep:
+                continue
+            if key == 'Question':
+                question = value.strip()
+            elif key == 'Correct Answer':
+                letter = value.strip()[:1]
+                if letter in 'ABCD':
+                    correct_index = ord(letter) - ord('A')
+            elif key == 'Explanation':
+                explanation_lines.append(value.strip())
+                in_explanation = True
+
+        explanation = '\n'.join(explanation_lines).strip()
+        return question, option_list, correct_index, explanation
+
+    except Exception as e:
+        logger.error(f"Error parsing quiz response: {e}")
+        return None, [], None, ''
+
+def _parse_questions(response_text):
+    """Turn a Gemini response into a list of parsed question tuples."""
+    if not response_text:
+        return []
+    try:
+        items = json.loads(response_text)
+    except json.JSONDecodeError:
+        # Model ignored JSON mode; fall back to the plain-text line scanner.
+        return [parse_quiz_response(block) for block in response_text.split('---') if block.strip()]
+
+    if isinstance(items, dict):
+        items = [items]
+    questions = []
+    for item in items:
+        try:
+            questions.append((
+                item['question'],
+                list(item['options']),
+                int(item['correct_index']),
+                item.get('explanation', '')
+            ))
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error(f"Malformed question object from Gemini: {e}")
+    return questions
+
+def load_pool():
+    try:
+        with open(_POOL_FILE) as f:
+            for item in json.load(f):
+                parsed = tuple(item)
+                _QUESTION_POOL.append((_vec(parsed[0]), parsed))
+        logger.info(f"Loaded {len(_QUESTION_POOL)} cached questions from {_POOL_FILE}")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"Error loading question pool: {e}")
+
+def save_pool():
+    try:
+        with open(_POOL_FILE, 'w') as f:
+            json.dump([parsed for vec, parsed in _QUESTION_POOL], f)
+    except Exception as e:
+        logger.error(f"Error saving question pool: {e}")
+
+async def _refill_pool():
+    global _refill_running
+    if _refill_running:
+        return
+    _refill_running = True
+    rejects = 0
+    try:
+        while len(_QUESTION_POOL) < _QUESTION_POOL.maxlen and rejects < 5:
+            # Request a full round concurrently so the batcher coalesces the
+            # whole round into one Gemini prompt instead of N batches of one.
+            want = min(MAX_BATCH, _QUESTION_POOL.maxlen - len(_QUESTION_POOL))
+            results = await asyncio.gather(*[generate_quiz_question() for _ in range(want)])
+            if all(parsed is None for parsed in results):
+                break
+            for parsed in results:
+                if parsed is None:
+                    continue
+                question, options, correct_index, explanation = parsed
+                if correct_index is None or not options:
+                    rejects += 1
+                    continue
+                vec = _vec(question)
+                if any(_sim(vec, pooled_vec) >= _DEDUP_THRESHOLD for pooled_vec, _ in _QUESTION_POOL):
+                    logger.info(f"Skipping near-duplicate question: {question!r}")
+                    rejects += 1
+                    continue
+                rejects = 0
+                _QUESTION_POOL.append((vec, parsed))
+    finally:
+        _refill_running = False
+
+async def next_question():
+    """Return a parsed question tuple, preferring the pool over a Gemini call."""
+    if len(_QUESTION_POOL) > _POOL_LOW_WATER:
+        vec, parsed = _QUESTION_POOL.popleft()
+    else:
+        parsed = await generate_quiz_question()
+        if parsed is None:
+            return None
+    if len(_QUESTION_POOL) <= _POOL_LOW_WATER:
+        task = asyncio.create_task(_refill_pool())
+        _refill_tasks.add(task)
+        task.add_done_callback(_refill_tasks.discard)
+    return parsed